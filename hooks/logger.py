@@ -4,52 +4,148 @@ Claude Code hook logger - logs all hook events to JSONL files.
 Handles transcript reading for Stop events and subagent response extraction.
 Uses state tracking to correlate agent_id with subagent_type.
 """
+import collections
+import functools
 import json
+import mmap
 import sys
 import os
-from datetime import datetime, timezone
-from pathlib import Path
-import fcntl
+import struct
+import time
+from contextlib import contextmanager
 
+# orjson is optional; its JSONDecodeError subclasses json.JSONDecodeError
+try:
+    import orjson
 
-def get_last_assistant_message(transcript_path: str) -> str:
-    """Extract last assistant message from transcript JSONL."""
+    def _dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which stdlib json still handles
+            return json.dumps(obj, separators=(",", ":")).encode()
+
+    def _loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, out-of-range floats or lone surrogates, which stdlib json accepts
+            return json.loads(data)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
+
+ASSISTANT_MARKER = b'"assistant"'
+MAX_RESPONSE_LENGTH = 5000
+
+
+def find_last_assistant_line(data, lo: int, hi: int):
+    """Return (start, stop) of the last line in data[lo:hi] containing ASSISTANT_MARKER, or None."""
+    marker = data.rfind(ASSISTANT_MARKER, lo, hi)
+    if marker < 0:
+        return None
+    newline = data.rfind(b"\n", lo, marker)
+    start = newline + 1 if newline >= 0 else lo
+    stop = data.find(b"\n", marker, hi)
+    return start, stop if stop >= 0 else hi
+
+
+def _now_ts() -> str:
+    """Current UTC time as YYYY-MM-DDTHH:MM:SSZ, without strftime's format parsing."""
+    t = time.gmtime()
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
+
+
+def _json_line(obj) -> bytes:
+    """Serialize obj as a compact JSONL line."""
+    return _dumps(obj) + b"\n"
+
+
+def _write_all(fd: int, payload: bytes):
+    """Write payload to fd with a single os.write, retrying on short writes."""
+    while payload:
+        written = os.write(fd, payload)
+        payload = payload[written:]
+
+
+def _join_text_blocks(content: list, max_len: int) -> str:
+    """Join text blocks with newlines, stopping once max_len is reached."""
+    texts = []
+    length = 0
+    for block in content:
+        if isinstance(block, dict) and block.get("type") == "text":
+            text = block.get("text", "")
+            texts.append(text)
+            length += len(text) + 1
+            if length > max_len:
+                break
+    return "\n".join(texts)[:max_len]
+
+
+def _assistant_line_text(line: bytes, max_len: int) -> str:
+    """Join the text blocks of a transcript line if it is an assistant entry."""
+    # Cheap substring check so most lines are never JSON-parsed
+    if ASSISTANT_MARKER not in line:
+        return ""
+    try:
+        entry = _loads(line)
+    except json.JSONDecodeError:
+        return ""
+    if not isinstance(entry, dict) or entry.get("type") != "assistant":
+        return ""
+    message = entry.get("message", {})
+    return _join_text_blocks(message.get("content", []), max_len)
+
+
+def get_last_assistant_message(transcript_path: str, max_len: int = MAX_RESPONSE_LENGTH) -> str:
+    """Extract last assistant message from transcript JSONL.
+
+    Memory-maps the transcript and scans backwards from the end, jumping
+    between lines that contain ASSISTANT_MARKER and only parsing those, so
+    only the tail pages actually touched are read from disk. Falls back to
+    a forward scan for files that cannot be mapped.
+    """
     if not transcript_path or not os.path.exists(transcript_path):
         return ""
 
-    last_assistant = ""
     try:
-        with open(transcript_path, 'r') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line.strip())
-                    if entry.get("type") == "assistant":
-                        message = entry.get("message", {})
-                        content = message.get("content", [])
-                        texts = []
-                        for block in content:
-                            if isinstance(block, dict) and block.get("type") == "text":
-                                texts.append(block.get("text", ""))
-                        if texts:
-                            last_assistant = "\n".join(texts)
-                except json.JSONDecodeError:
-                    continue
+        with open(transcript_path, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return ""  # Empty file
+            except OSError:
+                # Not mappable (e.g. a pipe or special file), scan forwards
+                last_assistant = ""
+                for line in f:
+                    text = _assistant_line_text(line, max_len)
+                    if text:
+                        last_assistant = text
+                return last_assistant
+            with mm:
+                end = len(mm)
+                while True:
+                    span = find_last_assistant_line(mm, 0, end)
+                    if span is None:
+                        return ""
+                    start, stop = span
+                    text = _assistant_line_text(mm[start:stop], max_len)
+                    if text:
+                        return text
+                    end = start
     except Exception:
-        pass
-    return last_assistant
+        return ""
 
 
-def extract_task_response(tool_response: dict) -> str:
-    """Extract text content from Task tool response."""
+def extract_task_response(tool_response: dict, max_len: int = MAX_RESPONSE_LENGTH) -> str:
+    """Extract text content from Task tool response, truncated to max_len."""
     if not tool_response:
         return ""
 
-    content = tool_response.get("content", [])
-    texts = []
-    for block in content:
-        if isinstance(block, dict) and block.get("type") == "text":
-            texts.append(block.get("text", ""))
-    return "\n".join(texts) if texts else ""
+    return _join_text_blocks(tool_response.get("content", []), max_len)
 
 
 def parse_transcript_stats(transcript_path: str) -> dict:
@@ -76,7 +172,7 @@ def parse_transcript_stats(transcript_path: str) -> dict:
         with open(transcript_path, 'r') as f:
             for line in f:
                 try:
-                    entry = json.loads(line.strip())
+                    entry = _loads(line)
                 except json.JSONDecodeError:
                     continue
 
@@ -133,6 +229,7 @@ def parse_transcript_stats(transcript_path: str) -> dict:
     # Calculate duration
     if stats["first_ts"] and stats["last_ts"]:
         try:
+            from datetime import datetime  # Deferred: only needed on session-level events
             first = datetime.fromisoformat(stats["first_ts"].replace("Z", "+00:00"))
             last = datetime.fromisoformat(stats["last_ts"].replace("Z", "+00:00"))
             stats["duration_seconds"] = (last - first).total_seconds()
@@ -173,73 +270,282 @@ def parse_transcript_stats(transcript_path: str) -> dict:
     return result
 
 
+# Agent state log framing: <I body length, then a msgpack or JSON array body
+STATE_FRAME_HEADER = struct.Struct("<I")
+STATE_INFO_FIELDS = ("subagent_type", "model", "description", "registered_at")
+
+
+@functools.lru_cache(maxsize=None)
+def _msgpack():
+    """Return the msgpack module, or None if it is not installed.
+
+    Imported on first use: only agent state reads and writes need it.
+    Without it, agent state records are JSON-encoded.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def _frame_record(record: list) -> bytes:
+    """Encode an agent state record as a length-prefixed frame."""
+    msgpack = _msgpack()
+    body = msgpack.packb(record) if msgpack else _dumps(record)
+    return STATE_FRAME_HEADER.pack(len(body)) + body
+
+
+def _unframe_record(body: bytes):
+    """Decode a frame body, or return None if it can't be decoded here."""
+    try:
+        if body[:1] == b"[":
+            return _loads(body)
+        msgpack = _msgpack()
+        if msgpack:
+            return msgpack.unpackb(body)
+    except Exception:
+        pass
+    return None
+
+
 class AgentStateTracker:
-    """Track agent_id → subagent_type mapping across hook invocations."""
+    """Track agent_id → subagent_type mapping across hook invocations.
+
+    State is kept as an append-only binary log of length-prefixed
+    ``[op, id, subagent_type, model, description, registered_at]`` records
+    (``set``/``pending``/``clear_pending``/``del``) that is replayed on read
+    and compacted into a snapshot once it grows past a size threshold. The
+    replayed state is cached on the instance and reused while the log file
+    is unchanged.
+    """
+
+    MAX_AGENTS = 100
+    # Framed records run ~60 bytes (msgpack) to ~110 (JSON, with a
+    # description), so the log holds roughly 2-4x the agent cap between
+    # compactions while a fresh snapshot stays well under the threshold
+    COMPACT_THRESHOLD = 4 * MAX_AGENTS * 64
+
+    def __init__(self, state_dir: str):
+        self.state_dir = os.fspath(state_dir)
+        self.state_file = os.path.join(self.state_dir, "agent_state.bin")
+        os.makedirs(self.state_dir, exist_ok=True)
+        self._cache = None
+        self._cache_stat = None
+        self._cache_end = 0
+
+    @staticmethod
+    def new_agent_info(subagent_type: str, model: str = None, description: str = None) -> dict:
+        """Build a state entry for an agent or pending task."""
+        return {
+            "subagent_type": subagent_type,
+            "model": model,
+            "description": description,
+            "registered_at": _now_ts()
+        }
 
-    def __init__(self, state_dir: Path):
-        self.state_file = state_dir / "agent_state.json"
-        self.state_dir = state_dir
-        self.state_dir.mkdir(parents=True, exist_ok=True)
+    @staticmethod
+    def _stat_key(st) -> tuple:
+        """Identify a version of the log file (appends change size and mtime)."""
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def _apply(state: collections.OrderedDict, record: list):
+        """Apply a single log record to the in-memory state.
+
+        Entries are kept in registration order, oldest first, so the state
+        can be trimmed from the front.
+        """
+        op, key = record[0], record[1]
+        info = dict(zip(STATE_INFO_FIELDS, record[2:]))
+        if op == "set":
+            state[key] = info
+            state.move_to_end(key)
+        elif op == "pending":
+            state[f"pending_{key}"] = info
+            state.move_to_end(f"pending_{key}")
+        elif op == "clear_pending":
+            state.pop(f"pending_{key}", None)
+        elif op == "del":
+            state.pop(key, None)
+
+    @staticmethod
+    def _record(key: str, info: dict) -> list:
+        """Build the log record that stores a state entry."""
+        fields = [info.get(name) for name in STATE_INFO_FIELDS]
+        if key.startswith("pending_"):
+            return ["pending", key[len("pending_"):], *fields]
+        return ["set", key, *fields]
+
+    def _replay(self, f) -> tuple:
+        """Rebuild state by replaying every record in the log.
+
+        Returns the state and the offset just past the last complete frame.
+        Anything beyond that offset is a torn append (e.g. a crash or ENOSPC
+        mid-write); writers truncate it away before appending, see
+        _load_locked, so later frames are never read out of alignment.
+        """
+        data = f.read()
+        state = collections.OrderedDict()
+        header_size = STATE_FRAME_HEADER.size
+        offset = 0
+        while offset + header_size <= len(data):
+            (length,) = STATE_FRAME_HEADER.unpack_from(data, offset)
+            start = offset + header_size
+            if start + length > len(data):
+                break
+            record = _unframe_record(data[start:start + length])
+            if isinstance(record, list) and len(record) >= 2:
+                self._apply(state, record)
+            offset = start + length
+        return state, offset
 
     def _read_state(self) -> dict:
-        """Read state with file locking."""
-        if not self.state_file.exists():
-            return {}
+        """Read state, reusing the cache if the log is unchanged.
+
+        No lock is taken: appends are single O_APPEND writes (a torn trailing
+        frame is skipped on replay) and compaction swaps the file in with
+        os.replace, so readers always see a consistent log.
+        """
         try:
-            with open(self.state_file, 'r') as f:
-                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
-                data = json.load(f)
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-                return data
-        except (json.JSONDecodeError, IOError):
+            with open(self.state_file, 'rb') as f:
+                # Stat before reading so a concurrent append invalidates the cache
+                stat_key = self._stat_key(os.fstat(f.fileno()))
+                if self._cache is not None and self._cache_stat == stat_key:
+                    return self._cache.copy()
+                data, end = self._replay(f)
+        except IOError:
             return {}
-
-    def _write_state(self, state: dict):
-        """Write state with file locking."""
+        self._set_cache(data, stat_key, end)
+        return data.copy()
+
+    def _set_cache(self, state: collections.OrderedDict, stat_key: tuple, end: int):
+        """Remember replayed state, the log version it came from and where its last frame ends."""
+        self._cache = state
+        self._cache_stat = stat_key
+        self._cache_end = end
+
+    def _open_locked(self):
+        """Open the log for appending with an exclusive lock on the live file.
+
+        Compaction swaps the log out via os.replace, so a lock taken on the
+        old inode is retried against the new one.
+        """
+        import fcntl  # Deferred: most hook events never touch the tracker
+
+        while True:
+            f = open(self.state_file, 'a+b')
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.state_file).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _load_locked(self, f) -> collections.OrderedDict:
+        """Return the current state, truncating a torn trailing frame first.
+
+        Must be called with the exclusive lock held on ``f``. Cutting the log
+        back to its last complete frame keeps the next append aligned.
+        """
+        st = os.fstat(f.fileno())
+        stat_key = self._stat_key(st)
+        if self._cache is not None and self._cache_stat == stat_key:
+            state, end = self._cache, self._cache_end
+        else:
+            f.seek(0)
+            state, end = self._replay(f)
+            self._set_cache(state, stat_key, end)
+        if end < st.st_size:
+            f.truncate(end)
+            self._set_cache(state, self._stat_key(os.fstat(f.fileno())), end)
+        return state.copy()
+
+    def _append(self, record: list):
+        """Append a record to the log, compacting it if it grew too large."""
         try:
-            with open(self.state_file, 'w') as f:
-                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-                json.dump(state, f)
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f = self._open_locked()
+            try:
+                self._load_locked(f)
+                _write_all(f.fileno(), _frame_record(record))
+                self._maybe_compact(f)
+            finally:
+                f.close()  # Closing releases the lock
         except IOError:
             pass
 
+    def _maybe_compact(self, f):
+        """Rewrite the log as a snapshot once it exceeds the threshold.
+
+        Must be called with the exclusive lock held on ``f``.
+        """
+        if os.fstat(f.fileno()).st_size <= self.COMPACT_THRESHOLD:
+            return
+        f.seek(0)
+        state, _ = self._replay(f)
+        # Keep only last MAX_AGENTS agents to prevent unbounded growth
+        while len(state) > self.MAX_AGENTS:
+            state.popitem(last=False)
+        tmp_file = f"{self.state_file}.tmp.{os.getpid()}"
+        payload = b"".join(_frame_record(self._record(key, info)) for key, info in state.items())
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _write_all(fd, payload)
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, self.state_file)
+
+    @contextmanager
+    def transaction(self):
+        """Read-modify-write the state under a single exclusive lock.
+
+        Yields a mutable state dict; changes made to it are appended to the
+        log in one write when the block exits.
+        """
+        try:
+            f = self._open_locked()
+        except IOError:
+            yield {}
+            return
+        try:
+            state = self._load_locked(f)
+            before = {key: dict(info) for key, info in state.items()}
+
+            yield state
+
+            records = []
+            for key in before:
+                if key not in state:
+                    if key.startswith("pending_"):
+                        records.append(["clear_pending", key[len("pending_"):], None, None, None, None])
+                    else:
+                        records.append(["del", key, None, None, None, None])
+            for key, info in state.items():
+                if before.get(key) != info:
+                    records.append(self._record(key, info))
+            if records:
+                _write_all(f.fileno(), b"".join(_frame_record(record) for record in records))
+            st = os.fstat(f.fileno())
+            self._set_cache(state.copy(), self._stat_key(st), st.st_size)
+            self._maybe_compact(f)
+        finally:
+            f.close()  # Closing releases the lock
+
     def register_agent(self, agent_id: str, subagent_type: str, model: str = None, description: str = None):
         """Register an agent with its type."""
         if not agent_id:
             return
-        state = self._read_state()
-        state[agent_id] = {
-            "subagent_type": subagent_type,
-            "model": model,
-            "description": description,
-            "registered_at": datetime.now(timezone.utc).isoformat()
-        }
-        # Keep only last 100 agents to prevent unbounded growth
-        if len(state) > 100:
-            sorted_agents = sorted(state.items(), key=lambda x: x[1].get("registered_at", ""))
-            state = dict(sorted_agents[-100:])
-        self._write_state(state)
+        self._append(self._record(agent_id, self.new_agent_info(subagent_type, model, description)))
 
     def set_pending_task(self, session_id: str, subagent_type: str, model: str = None, description: str = None):
         """Store pending task info (before agent_id is known)."""
-        state = self._read_state()
-        state[f"pending_{session_id}"] = {
-            "subagent_type": subagent_type,
-            "model": model,
-            "description": description,
-            "registered_at": datetime.now(timezone.utc).isoformat()
-        }
-        self._write_state(state)
+        self._append(self._record(f"pending_{session_id}", self.new_agent_info(subagent_type, model, description)))
 
     def get_and_clear_pending_task(self, session_id: str) -> dict:
         """Get and clear pending task info."""
-        state = self._read_state()
-        key = f"pending_{session_id}"
-        info = state.pop(key, {})
-        if info:
-            self._write_state(state)
-        return info
+        with self.transaction() as state:
+            return state.pop(f"pending_{session_id}", {})
 
     def lookup_agent(self, agent_id: str) -> dict:
         """Lookup agent info by agent_id."""
@@ -249,112 +555,122 @@ class AgentStateTracker:
         return state.get(agent_id, {})
 
 
-def main():
-    # Setup log directory
+# Tool-specific params flattened into the log entry: tool_name -> ((log_key, tool_input_key), ...)
+FLATTEN_FIELDS = {
+    "Task": (
+        ("subagent_type", "subagent_type"),
+        ("subagent_model", "model"),
+        ("subagent_description", "description"),
+        ("subagent_run_in_background", "run_in_background"),
+        ("subagent_resume", "resume"),
+    ),
+    "Bash": (
+        ("bash_command", "command"),
+        ("bash_description", "description"),
+        ("bash_timeout", "timeout"),
+        ("bash_background", "run_in_background"),
+        ("bash_no_sandbox", "dangerouslyDisableSandbox"),
+    ),
+    "Read": (
+        ("file_path", "file_path"),
+        ("read_offset", "offset"),
+        ("read_limit", "limit"),
+    ),
+    "Write": (
+        ("file_path", "file_path"),
+    ),
+    "Edit": (
+        ("file_path", "file_path"),
+        ("edit_replace_all", "replace_all"),
+    ),
+    "Grep": (
+        ("grep_pattern", "pattern"),
+        ("grep_path", "path"),
+        ("grep_glob", "glob"),
+        ("grep_output_mode", "output_mode"),
+    ),
+    "Glob": (
+        ("glob_pattern", "pattern"),
+        ("glob_path", "path"),
+    ),
+    "WebSearch": (
+        ("search_query", "query"),
+    ),
+    "WebFetch": (
+        ("fetch_url", "url"),
+    ),
+    "TaskOutput": (
+        ("task_output_id", "task_id"),
+        ("task_output_block", "block"),
+        ("task_output_timeout", "timeout"),
+    ),
+}
+
+
+def get_log_dir() -> str:
+    """Log directory for the current project."""
     project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
-    log_dir = Path(project_dir) / "hooks" / "logs"
-    log_dir.mkdir(parents=True, exist_ok=True)
+    return os.path.join(project_dir, "hooks", "logs")
 
-    # Initialize state tracker
-    tracker = AgentStateTracker(log_dir)
 
-    # Read hook input from stdin
+def parse_payload(raw: bytes):
+    """Parse a raw hook payload, returning None if it is not a JSON object."""
     try:
-        input_data = json.load(sys.stdin)
+        input_data = _loads(raw) if raw else None
     except json.JSONDecodeError:
-        sys.exit(0)  # Silent fail, don't block Claude
+        return None
+    return input_data if isinstance(input_data, dict) else None
+
 
+def build_log_entry(input_data: dict, log_dir: str, tracker: AgentStateTracker = None) -> dict:
+    """Build the flattened log entry for a hook payload, updating agent state.
+
+    A long-lived caller can pass its own tracker to reuse the cached state;
+    otherwise one is created only for the events that need it.
+    """
     # Extract common fields
     session_id = input_data.get("session_id", "unknown")
     event = input_data.get("hook_event_name", "unknown")
     tool_name = input_data.get("tool_name")
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    ts = _now_ts()
 
     # Get tool_input
     tool_input = input_data.get("tool_input") or {}
 
-    # Build log entry with flattened key fields
-    log_entry = {
-        "ts": ts,
-        "session_id": session_id,
-        "event": event,
-        "tool_name": tool_name,
-        "tool_input": tool_input,
-        "prompt": input_data.get("prompt"),
-        "cwd": input_data.get("cwd"),
-        "permission_mode": input_data.get("permission_mode"),
-    }
+    # Build log entry with flattened key fields, skipping None values
+    log_entry = {}
+
+    def put(key, value):
+        if value is not None:
+            log_entry[key] = value
+
+    put("ts", ts)
+    put("session_id", session_id)
+    put("event", event)
+    put("tool_name", tool_name)
+    put("tool_input", tool_input)
+    put("prompt", input_data.get("prompt"))
+    put("cwd", input_data.get("cwd"))
+    put("permission_mode", input_data.get("permission_mode"))
 
     # Flatten tool-specific params for easier filtering
     if tool_input:
-        # Task tool
-        if tool_name == "Task":
-            log_entry["subagent_type"] = tool_input.get("subagent_type")
-            log_entry["subagent_model"] = tool_input.get("model")
-            log_entry["subagent_description"] = tool_input.get("description")
-            log_entry["subagent_run_in_background"] = tool_input.get("run_in_background")
-            log_entry["subagent_resume"] = tool_input.get("resume")
-
-            # On PreToolUse, store as pending (agent_id not known yet)
-            if event == "PreToolUse":
-                tracker.set_pending_task(
-                    session_id=session_id,
-                    subagent_type=tool_input.get("subagent_type"),
-                    model=tool_input.get("model"),
-                    description=tool_input.get("description")
-                )
+        for log_key, input_key in FLATTEN_FIELDS.get(tool_name, ()):
+            put(log_key, tool_input.get(input_key))
 
-        # Bash tool
-        elif tool_name == "Bash":
-            log_entry["bash_command"] = tool_input.get("command")
-            log_entry["bash_description"] = tool_input.get("description")
-            log_entry["bash_timeout"] = tool_input.get("timeout")
-            log_entry["bash_background"] = tool_input.get("run_in_background")
-            log_entry["bash_no_sandbox"] = tool_input.get("dangerouslyDisableSandbox")
-
-        # Read tool
-        elif tool_name == "Read":
-            log_entry["file_path"] = tool_input.get("file_path")
-            log_entry["read_offset"] = tool_input.get("offset")
-            log_entry["read_limit"] = tool_input.get("limit")
-
-        # Write tool
-        elif tool_name == "Write":
-            log_entry["file_path"] = tool_input.get("file_path")
-            # content can be large, just note its length
+        # Write content can be large, just note its length
+        if tool_name == "Write":
             content = tool_input.get("content", "")
-            log_entry["write_content_length"] = len(content) if content else 0
-
-        # Edit tool
-        elif tool_name == "Edit":
-            log_entry["file_path"] = tool_input.get("file_path")
-            log_entry["edit_replace_all"] = tool_input.get("replace_all")
-
-        # Grep tool
-        elif tool_name == "Grep":
-            log_entry["grep_pattern"] = tool_input.get("pattern")
-            log_entry["grep_path"] = tool_input.get("path")
-            log_entry["grep_glob"] = tool_input.get("glob")
-            log_entry["grep_output_mode"] = tool_input.get("output_mode")
-
-        # Glob tool
-        elif tool_name == "Glob":
-            log_entry["glob_pattern"] = tool_input.get("pattern")
-            log_entry["glob_path"] = tool_input.get("path")
-
-        # WebSearch tool
-        elif tool_name == "WebSearch":
-            log_entry["search_query"] = tool_input.get("query")
-
-        # WebFetch tool
-        elif tool_name == "WebFetch":
-            log_entry["fetch_url"] = tool_input.get("url")
-
-        # TaskOutput tool
-        elif tool_name == "TaskOutput":
-            log_entry["task_output_id"] = tool_input.get("task_id")
-            log_entry["task_output_block"] = tool_input.get("block")
-            log_entry["task_output_timeout"] = tool_input.get("timeout")
+            put("write_content_length", len(content) if content else 0)
+
+        # On Task PreToolUse, store as pending (agent_id not known yet)
+        elif tool_name == "Task" and event == "PreToolUse":
+            (tracker or AgentStateTracker(log_dir)).set_pending_task(
+                session_id=session_id,
+                subagent_type=tool_input.get("subagent_type"),
+                model=tool_input.get("model"),
+                description=tool_input.get("description")
+            )
 
     # For PostToolUse, handle tool_response specially
     if event == "PostToolUse":
@@ -363,12 +679,12 @@ def main():
         # For Task tool, extract subagent response text and agent_id
         if tool_name == "Task" and tool_response:
             agent_id = tool_response.get("agentId")
-            log_entry["agent_id"] = agent_id
-            log_entry["subagent_response"] = extract_task_response(tool_response)[:5000]
+            put("agent_id", agent_id)
+            put("subagent_response", extract_task_response(tool_response))
 
             # Register agent for later lookup in SubagentStop
             if agent_id and tool_input:
-                tracker.register_agent(
+                (tracker or AgentStateTracker(log_dir)).register_agent(
                     agent_id=agent_id,
                     subagent_type=tool_input.get("subagent_type"),
                     model=tool_input.get("model"),
@@ -376,92 +692,128 @@ def main():
                 )
         else:
             # For other tools, include full response
-            log_entry["tool_response"] = tool_response
+            put("tool_response", tool_response)
 
     # For Stop, extract assistant response from transcript
     if event == "Stop":
         transcript_path = input_data.get("transcript_path", "")
         response = get_last_assistant_message(transcript_path)
-        log_entry["assistant_response"] = response[:5000] if response else None
-        log_entry["stop_hook_active"] = input_data.get("stop_hook_active")
+        put("assistant_response", response or None)
+        put("stop_hook_active", input_data.get("stop_hook_active"))
 
     # For SubagentStop, try agent_transcript_path first, then transcript_path
     if event == "SubagentStop":
         # Try agent-specific transcript first
         transcript_path = input_data.get("agent_transcript_path") or input_data.get("transcript_path", "")
         response = get_last_assistant_message(transcript_path)
-        log_entry["assistant_response"] = response[:5000] if response else None
+        put("assistant_response", response or None)
         agent_id = input_data.get("agent_id")
-        log_entry["agent_id"] = agent_id
-        log_entry["stop_hook_active"] = input_data.get("stop_hook_active")
-
-        # Lookup agent info from state tracker
-        agent_info = tracker.lookup_agent(agent_id)
+        put("agent_id", agent_id)
+        put("stop_hook_active", input_data.get("stop_hook_active"))
+
+        # Lookup agent info from state tracker, all under a single lock
+        tracker = tracker or AgentStateTracker(log_dir)
+        with tracker.transaction() as state:
+            agent_info = state.get(agent_id, {}) if agent_id else {}
+            if not agent_info:
+                # Fallback to pending task (SubagentStop fires before PostToolUse)
+                agent_info = state.pop(f"pending_{session_id}", {})
+                if agent_info and agent_id:
+                    # Also register the agent now that we know the id
+                    state[agent_id] = tracker.new_agent_info(
+                        subagent_type=agent_info.get("subagent_type"),
+                        model=agent_info.get("model"),
+                        description=agent_info.get("description")
+                    )
         if agent_info:
-            log_entry["subagent_type"] = agent_info.get("subagent_type")
-            log_entry["subagent_model"] = agent_info.get("model")
-            log_entry["subagent_description"] = agent_info.get("description")
-        else:
-            # Fallback to pending task (SubagentStop fires before PostToolUse)
-            pending = tracker.get_and_clear_pending_task(session_id)
-            if pending:
-                log_entry["subagent_type"] = pending.get("subagent_type")
-                log_entry["subagent_model"] = pending.get("model")
-                log_entry["subagent_description"] = pending.get("description")
-                # Also register the agent now that we know the id
-                tracker.register_agent(
-                    agent_id=agent_id,
-                    subagent_type=pending.get("subagent_type"),
-                    model=pending.get("model"),
-                    description=pending.get("description")
-                )
+            put("subagent_type", agent_info.get("subagent_type"))
+            put("subagent_model", agent_info.get("model"))
+            put("subagent_description", agent_info.get("description"))
 
     # For SessionStart/SessionEnd, capture source/reason
     if event == "SessionStart":
-        log_entry["source"] = input_data.get("source")
-        log_entry["transcript_path"] = input_data.get("transcript_path")
+        put("source", input_data.get("source"))
+        put("transcript_path", input_data.get("transcript_path"))
         # Parse transcript for session stats (useful on resume/compact)
         transcript_stats = parse_transcript_stats(input_data.get("transcript_path"))
         if transcript_stats:
-            log_entry["transcript_stats"] = transcript_stats
+            put("transcript_stats", transcript_stats)
     if event == "SessionEnd":
-        log_entry["reason"] = input_data.get("reason")
+        put("reason", input_data.get("reason"))
         # Capture final session stats
         transcript_stats = parse_transcript_stats(input_data.get("transcript_path"))
         if transcript_stats:
-            log_entry["transcript_stats"] = transcript_stats
+            put("transcript_stats", transcript_stats)
 
     # For Notification, capture message and type
     if event == "Notification":
-        log_entry["message"] = input_data.get("message")
-        log_entry["notification_type"] = input_data.get("notification_type")
+        put("message", input_data.get("message"))
+        put("notification_type", input_data.get("notification_type"))
 
     # For PreCompact, capture trigger and custom_instructions
     if event == "PreCompact":
-        log_entry["trigger"] = input_data.get("trigger")
-        log_entry["custom_instructions"] = input_data.get("custom_instructions")
-        log_entry["transcript_path"] = input_data.get("transcript_path")
+        put("trigger", input_data.get("trigger"))
+        put("custom_instructions", input_data.get("custom_instructions"))
+        put("transcript_path", input_data.get("transcript_path"))
         # Parse transcript for pre-compact stats
         transcript_stats = parse_transcript_stats(input_data.get("transcript_path"))
         if transcript_stats:
-            log_entry["transcript_stats"] = transcript_stats
+            put("transcript_stats", transcript_stats)
 
-    # Remove None values for cleaner output
-    log_entry = {k: v for k, v in log_entry.items() if v is not None}
+    return log_entry
 
-    # Write to session-specific file
-    session_file = log_dir / f"hooks-{session_id}.jsonl"
-    with open(session_file, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
 
-    # Update latest.jsonl symlink
-    latest_link = log_dir / "latest.jsonl"
+def append_log_entry(log_dir: str, session_id: str, log_entry: dict):
+    """Append a log entry to the session-specific file."""
+    session_file = os.path.join(log_dir, f"hooks-{session_id}.jsonl")
+    fd = os.open(session_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
     try:
-        latest_link.unlink(missing_ok=True)
-        latest_link.symlink_to(f"hooks-{session_id}.jsonl")
-    except Exception:
-        pass  # Symlink update is best-effort
+        _write_all(fd, _json_line(log_entry))
+    finally:
+        os.close(fd)
+
 
+def update_latest_link(log_dir: str, session_id: str):
+    """Point latest.jsonl at the session log, unless it already does."""
+    latest_link = os.path.join(log_dir, "latest.jsonl")
+    link_target = f"hooks-{session_id}.jsonl"
+    try:
+        current_target = os.readlink(latest_link)
+    except OSError:
+        current_target = None
+    if current_target != link_target:
+        # Swap atomically: create a temp link, rename over
+        tmp_link = f"{latest_link}.{os.getpid()}.new"
+        try:
+            try:
+                os.symlink(link_target, tmp_link)
+            except FileExistsError:
+                # Leftover from a crashed run that had the same pid
+                os.unlink(tmp_link)
+                os.symlink(link_target, tmp_link)
+            os.replace(tmp_link, latest_link)
+        except OSError:
+            pass  # Symlink update is best-effort
+
+
+def log_payload(raw: bytes, log_dir: str, tracker: AgentStateTracker = None):
+    """Log a raw hook payload; invalid payloads are silently ignored."""
+    input_data = parse_payload(raw)
+    if input_data is None:
+        return  # Silent fail, don't block Claude
+    log_entry = build_log_entry(input_data, log_dir, tracker)
+    session_id = input_data.get("session_id", "unknown")
+    append_log_entry(log_dir, session_id, log_entry)
+    update_latest_link(log_dir, session_id)
+
+
+def main():
+    # Setup log directory
+    log_dir = get_log_dir()
+    os.makedirs(log_dir, exist_ok=True)
+
+    # Read hook input from stdin
+    log_payload(sys.stdin.buffer.read(), log_dir)
     sys.exit(0)
 
 
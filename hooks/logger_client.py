@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Claude Code hook client - forwards the hook payload to logger_daemon.py over
+a Unix socket. If no daemon is listening, starts one in the background and
+logs this payload in-process with logger.py instead.
+"""
+import os
+import socket
+import sys
+import time
+
+HOOKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_NAME = ".sock"
+FAILED_MARKER = ".sock.failed"  # Touched in log_dir when the daemon can't listen
+SPAWN_BACKOFF = 300  # seconds without spawning after a daemon failed to start
+CONNECT_TIMEOUT = 2  # seconds, so a backed-up daemon can't stall the hook
+# sun_path holds 108 bytes on Linux and 104 on macOS, including the NUL
+MAX_SOCKET_PATH = 103
+
+
+def socket_path(log_dir: str):
+    """Path of the daemon socket for a log directory, or None if none fits.
+
+    The socket lives in log_dir unless that path is too long for AF_UNIX,
+    in which case a name hashed from log_dir is used inside a private
+    per-user directory under the runtime (or temp) directory. Payloads
+    carry prompts and file contents, so that directory is only used if it
+    is ours and closed to other users.
+    """
+    path = os.path.join(log_dir, SOCKET_NAME)
+    if len(os.fsencode(path)) <= MAX_SOCKET_PATH:
+        return path
+    import hashlib  # Deferred: only deeply nested project dirs get here
+    import stat
+    import tempfile
+
+    run_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    private_dir = os.path.join(run_dir, f"claude-hooks-{os.getuid()}")
+    try:
+        os.mkdir(private_dir, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    try:
+        st = os.lstat(private_dir)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None  # Someone else's (or a symlink): never send payloads there
+
+    digest = hashlib.sha1(os.fsencode(os.path.abspath(log_dir))).hexdigest()[:16]
+    path = os.path.join(private_dir, f"{digest}.sock")
+    return path if len(os.fsencode(path)) <= MAX_SOCKET_PATH else None
+
+
+def daemon_failed_recently(log_dir: str) -> bool:
+    """Whether a daemon for log_dir failed to start within SPAWN_BACKOFF."""
+    try:
+        failed_at = os.stat(os.path.join(log_dir, FAILED_MARKER)).st_mtime
+    except OSError:
+        return False
+    return time.time() - failed_at < SPAWN_BACKOFF
+
+
+def spawn_daemon(log_dir: str):
+    """Start logger_daemon.py fully detached from this hook (double fork)."""
+    if os.fork():
+        os.wait()
+        return
+    try:
+        os.setsid()
+        if os.fork() == 0:
+            # Drop the hook's stdio so Claude doesn't wait on the daemon
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            daemon = os.path.join(HOOKS_DIR, "logger_daemon.py")
+            os.execv(sys.executable, [sys.executable, daemon, log_dir])
+    finally:
+        os._exit(0)
+
+
+def main():
+    payload = sys.stdin.buffer.read()
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", os.getcwd())
+    log_dir = os.path.join(project_dir, "hooks", "logs")
+    path = socket_path(log_dir)
+
+    # No usable socket path means no daemon: skip straight to in-process logging
+    if path is not None:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect(path)
+                sock.sendall(payload)
+            return
+        except socket.timeout:
+            spawn = False  # A daemon is running but backed up
+        except OSError:
+            spawn = not daemon_failed_recently(log_dir)  # No daemon listening
+
+        if spawn:
+            try:
+                spawn_daemon(log_dir)
+            except OSError:
+                pass  # Daemon is an optimization; logging below still happens
+
+    # Deferred: only pay for logger.py's imports when the daemon is unavailable
+    import logger
+    os.makedirs(log_dir, exist_ok=True)
+    logger.log_payload(payload, log_dir)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Claude Code hook logger daemon - a long-lived logger.py that receives hook
+payloads over a Unix socket, so hook invocations skip interpreter startup.
+Started on demand by logger_client.py; exits after IDLE_TIMEOUT seconds
+without events. Log writes happen on a background thread so handling the
+next payload never waits on them.
+"""
+import collections
+import fcntl
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+
+from logger import (
+    AgentStateTracker,
+    _json_line,
+    _write_all,
+    build_log_entry,
+    get_log_dir,
+    parse_payload,
+    update_latest_link,
+)
+from logger_client import FAILED_MARKER, SOCKET_NAME, socket_path
+
+IDLE_TIMEOUT = 600  # seconds
+RECV_TIMEOUT = 5  # seconds, so a stuck client can't stall the daemon
+MAX_OPEN_LOGS = 64  # session log fds kept open by the writer
+# Modules the daemon runs; editing any of them makes it exit so the next hook
+# starts a fresh daemon with the new code
+SOURCE_FILES = tuple(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ("logger.py", "logger_client.py", "logger_daemon.py")
+)
+
+
+def source_mtimes():
+    """mtimes of SOURCE_FILES, or None if one is missing (mid-save)."""
+    try:
+        return tuple(os.stat(path).st_mtime_ns for path in SOURCE_FILES)
+    except OSError:
+        return None
+
+
+class LogWriter(threading.Thread):
+    """Background thread appending log lines to the session files.
+
+    Lines queued while a write is in progress are coalesced, so each
+    session file gets a single os.write per batch. Session files stay open
+    in an LRU of up to MAX_OPEN_LOGS fds instead of being reopened per line;
+    a cached fd is reopened if its file was deleted or replaced meanwhile.
+    """
+
+    def __init__(self, log_dir: str):
+        super().__init__(name="log-writer", daemon=True)
+        self.log_dir = log_dir
+        self._queue = queue.SimpleQueue()
+        self._fds = collections.OrderedDict()  # session_id -> fd, least recent first
+
+    def submit(self, session_id: str, line: bytes):
+        """Queue a line for the session's log file."""
+        self._queue.put((session_id, line))
+
+    def close(self):
+        """Flush everything queued and stop the thread."""
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        stop = False
+        while not stop:
+            # Block for the first item, then drain whatever else is queued
+            batch = {}
+            item = self._queue.get()
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    batch.setdefault(item[0], []).append(item[1])
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            for session_id, lines in batch.items():
+                self._write(session_id, b"".join(lines))
+        while self._fds:
+            os.close(self._fds.popitem()[1])
+
+    @staticmethod
+    def _is_current(fd: int, path: str) -> bool:
+        """Whether fd is still the file at path (not deleted or replaced)."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        fst = os.fstat(fd)
+        return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+    def _fd(self, session_id: str) -> int:
+        """Return the open fd for a session's log file, opening it if needed."""
+        session_file = os.path.join(self.log_dir, f"hooks-{session_id}.jsonl")
+        fd = self._fds.get(session_id)
+        if fd is not None and not self._is_current(fd, session_file):
+            # e.g. `rm hooks/logs/*` mid-session: don't keep writing to the old inode
+            os.close(self._fds.pop(session_id))
+            fd = None
+        if fd is None:
+            if len(self._fds) >= MAX_OPEN_LOGS:
+                os.close(self._fds.popitem(last=False)[1])
+            fd = os.open(session_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._fds[session_id] = fd
+        else:
+            self._fds.move_to_end(session_id)
+        return fd
+
+    def _write(self, session_id: str, payload: bytes):
+        try:
+            _write_all(self._fd(session_id), payload)
+        except OSError:
+            # Same as a failed hook: drop the lines, keep the daemon up
+            fd = self._fds.pop(session_id, None)
+            if fd is not None:
+                os.close(fd)
+
+
+def read_payload(conn: socket.socket) -> bytes:
+    """Read a full payload; the client closes its end when done sending."""
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def handle_connection(conn: socket.socket, log_dir: str, tracker: AgentStateTracker, writer: LogWriter):
+    """Log the payload sent over one client connection."""
+    with conn:
+        conn.settimeout(RECV_TIMEOUT)
+        try:
+            input_data = parse_payload(read_payload(conn))
+            if input_data is None:
+                return
+            log_entry = build_log_entry(input_data, log_dir, tracker)
+            session_id = input_data.get("session_id", "unknown")
+            writer.submit(session_id, _json_line(log_entry))
+            update_latest_link(log_dir, session_id)
+        except Exception:
+            pass  # A bad payload must never take the daemon down
+
+
+class _Shutdown(BaseException):
+    """Raised from the SIGTERM handler to stop accepting new connections."""
+
+
+def _shutdown_on_sigterm(signum, frame):
+    raise _Shutdown()
+
+
+def serve(log_dir: str):
+    """Accept and log hook payloads until idle for IDLE_TIMEOUT seconds.
+
+    Also stops after an event once any of SOURCE_FILES has changed.
+    """
+    path = socket_path(log_dir)
+    if path is None:
+        return  # Clients won't try to connect either
+    os.makedirs(log_dir, exist_ok=True)
+
+    # Only one daemon per log directory; the lock is held for our lifetime
+    lock_file = os.path.join(log_dir, f"{SOCKET_NAME}.lock")
+    lock_fd = os.open(lock_file, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        return
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    failed_marker = os.path.join(log_dir, FAILED_MARKER)
+    try:
+        # Any socket file still around is stale: its daemon no longer holds the lock
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server.bind(path)
+        server.listen(64)
+    except OSError:
+        # e.g. no AF_UNIX support on this filesystem; clients back off spawning
+        server.close()
+        with open(failed_marker, 'w'):
+            pass
+        os.close(lock_fd)
+        return
+    try:
+        os.unlink(failed_marker)
+    except FileNotFoundError:
+        pass
+
+    started_with = source_mtimes()
+    writer = LogWriter(log_dir)
+    writer.start()
+    signal.signal(signal.SIGTERM, _shutdown_on_sigterm)
+    try:
+        server.settimeout(IDLE_TIMEOUT)
+        tracker = AgentStateTracker(log_dir)
+        try:
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    break
+                handle_connection(conn, log_dir, tracker, writer)
+                if source_mtimes() != started_with:
+                    break  # Our code was edited; stop serving the old version
+        except _Shutdown:
+            pass
+
+        # Stop new clients first, then drain connections already queued
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server.setblocking(False)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except BlockingIOError:
+                break
+            conn.setblocking(True)
+            handle_connection(conn, log_dir, tracker, writer)
+    finally:
+        server.close()
+        writer.close()
+        os.close(lock_fd)
+
+
+def main():
+    log_dir = sys.argv[1] if len(sys.argv) > 1 else get_log_dir()
+    serve(log_dir)
+
+
+if __name__ == "__main__":
+    main()